@@ -0,0 +1,193 @@
+"""
+Accumulate breakpoints targets across polls incrementally, with bounded memory and TOML size
+"""
+import logging
+from bisect import insort
+from collections import OrderedDict
+
+from rich.logging import RichHandler
+
+from swordfish import readfish_toml
+
+formatter = logging.Formatter(
+        "[%(asctime)s] %(levelname)s - %(message)s", "%Y-%m-%d %H:%M:%S"
+    )
+handler = RichHandler()
+handler.setFormatter(formatter)
+f_handler = logging.FileHandler("swordfish.log")
+f_handler.setFormatter(formatter)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(handler)
+logger.addHandler(f_handler)
+
+
+def _target_bytes(target):
+    """
+    Size in bytes of a target in the TOML targets array, as ' "target",' with any escaping
+    """
+    return len(readfish_toml.dump_value(target).encode()) + 2
+
+
+class _BarcodeTargets:
+    """
+    The targets held for one barcode, in sorted order for the TOML, and in order of when minoTour last reported them
+    """
+
+    def __init__(self):
+        self.sorted = []
+        self.last_seen = OrderedDict()
+        self.n_bytes = 0
+
+    def add(self, targets, poll):
+        """
+        Record minoTour reporting targets on this poll, returning the number that are new
+        """
+        new_targets = []
+        for target in targets:
+            if target in self.last_seen:
+                self.last_seen.move_to_end(target)
+            else:
+                new_targets.append(target)
+            self.last_seen[target] = poll
+        if len(new_targets) > 32:
+            # Timsort merges the sorted run with the new targets far quicker than inserting them one by one
+            self.sorted.extend(new_targets)
+            self.sorted.sort()
+        else:
+            for target in new_targets:
+                insort(self.sorted, target)
+        self.n_bytes += sum(map(_target_bytes, new_targets))
+        return len(new_targets)
+
+    def evict_oldest(self):
+        """
+        Forget the target that minoTour reported least recently, returning the poll it was last reported on.
+        The sorted targets are not updated until prune is called, so that evicting many targets stays linear
+        """
+        target, poll = self.last_seen.popitem(last=False)
+        self.n_bytes -= _target_bytes(target)
+        return poll
+
+    def prune(self):
+        """
+        Drop evicted targets from the sorted targets, in one pass
+        """
+        last_seen = self.last_seen
+        self.sorted = [target for target in self.sorted if target in last_seen]
+
+    def oldest_poll(self):
+        """
+        The poll the least recently reported target was last reported on, or None if there are no targets
+        """
+        return next(iter(self.last_seen.values()), None)
+
+
+class TargetAccumulator:
+    """
+    Accrue the targets minoTour reports for each barcode across polls, remembering what has already been merged.
+
+    Each poll only the targets minoTour reports are looked at, new ones are inserted in sorted order and known ones are
+    marked as seen. Targets minoTour has not reported for max_age polls are aged out, and if a barcode is over its
+    budget of targets or TOML bytes the least recently reported targets are evicted until it fits.
+    """
+
+    def __init__(self, existing_barcodes=None, max_age=None, max_targets=None, max_bytes=None):
+        """
+        Parameters
+        ----------
+        existing_barcodes: dict
+            Barcode names keyed to the conditions we already have for them, whose targets we start from
+        max_age: int
+            Number of polls a target can go unreported before it is aged out. Default - never
+        max_targets: int
+            Maximum number of targets per barcode. Default - unlimited
+        max_bytes: int
+            Maximum size of the targets array per barcode in the TOML, in bytes. Default - unlimited
+        """
+        self.max_age = max_age
+        self.max_targets = max_targets
+        self.max_bytes = max_bytes
+        self.poll = 0
+        self._targets = {}
+        self._conditions = {}
+        for barcode, conditions in (existing_barcodes or {}).items():
+            self._keep_conditions(barcode, conditions)
+            if barcode in self._targets:
+                self._targets[barcode].add(conditions.get("targets", []), self.poll)
+
+    def _keep_conditions(self, barcode, conditions):
+        self._conditions[barcode] = dict(conditions)
+        if isinstance(conditions.get("targets", []), list):
+            # Keep the targets key where it was, so the TOML is laid out as minoTour sent it
+            self._conditions[barcode]["targets"] = None
+            self._targets.setdefault(barcode, _BarcodeTargets())
+        else:
+            # Targets given as a path to a file are passed through as they are
+            self._targets.pop(barcode, None)
+
+    def _age_out(self, barcode, barcode_targets):
+        aged = 0
+        while barcode_targets.last_seen and barcode_targets.oldest_poll() <= self.poll - self.max_age:
+            barcode_targets.evict_oldest()
+            aged += 1
+        if aged:
+            barcode_targets.prune()
+            logger.info(f"{barcode}: aged out {aged} targets not reported in the last {self.max_age} polls.")
+
+    def _enforce_budget(self, barcode, barcode_targets):
+        evicted, newest_evicted = 0, None
+        while barcode_targets.last_seen and (
+            (self.max_targets is not None and len(barcode_targets.last_seen) > self.max_targets)
+            or (self.max_bytes is not None and barcode_targets.n_bytes > self.max_bytes)
+        ):
+            newest_evicted = barcode_targets.evict_oldest()
+            evicted += 1
+        if evicted:
+            barcode_targets.prune()
+            logger.warning(
+                f"{barcode}: over budget of {self.max_targets or 'unlimited'} targets and "
+                f"{self.max_bytes or 'unlimited'} TOML bytes, evicted the {evicted} least recently reported targets, "
+                f"last reported as recently as poll {newest_evicted} of {self.poll}. "
+                f"{len(barcode_targets.last_seen)} targets, {barcode_targets.n_bytes} bytes remain."
+            )
+
+    def update(self, new_data, behaviours):
+        """
+        Merge the targets fetched from minoTour this poll, and apply the behaviours to each barcode
+        Parameters
+        ----------
+        new_data: dict
+            Data that has been fetched from minoTour this iteration
+        behaviours: dict
+            dict containing behaviours as provided
+        Returns
+        -------
+        dict
+            Data to be written to the toml file, for every barcode we hold conditions for
+        """
+        self.poll += 1
+        new_targets = 0
+        for barcode, conditions in new_data.items():
+            self._keep_conditions(barcode, conditions)
+            if barcode in self._targets:
+                new_targets += self._targets[barcode].add(conditions.get("targets", []), self.poll)
+        data = {}
+        for barcode, kept_conditions in self._conditions.items():
+            conditions = dict(kept_conditions)
+            barcode_targets = self._targets.get(barcode)
+            if barcode_targets is not None:
+                if self.max_age:
+                    self._age_out(barcode, barcode_targets)
+                self._enforce_budget(barcode, barcode_targets)
+                conditions["targets"] = list(barcode_targets.sorted)
+            conditions.update(behaviours["chunk_settings"])
+            conditions.update(behaviours["unblock_behaviour"])
+            data[barcode] = conditions
+        logger.info(
+            f"Poll {self.poll}: {new_targets} new targets, "
+            f"{sum(len(barcode_targets.sorted) for barcode_targets in self._targets.values())} held across "
+            f"{len(self._targets)} barcodes."
+        )
+        return data
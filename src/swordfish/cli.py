@@ -11,9 +11,18 @@ import pkg_resources  # part of setuptools
 from rich.logging import RichHandler
 
 from swordfish.monitor import monitor
+from swordfish.parallel_merge import DEFAULT_THRESHOLD
+from swordfish.reanalyse import reanalyse
 from swordfish.utils import get_device, print_args
 DEFAULT_FREQ = 60
 
+
+def loadtest(args, sf_version):
+    # Imported here, as loadtest needs Python 3.7 and the Unix only resource module, which monitoring does not
+    from swordfish.loadtest import loadtest as run_loadtest
+    run_loadtest(args, sf_version)
+
+
 version = pkg_resources.require("swordfish")[0].version
 parser = argparse.ArgumentParser(description="swordfish app")
 
@@ -25,8 +34,14 @@ parser_breakpoints = subparsers.add_parser("breakpoints", help="Connect to minoT
 parser_breakpoints.set_defaults(func=monitor)
 parser_balance = subparsers.add_parser("balance", help="Connect to minoTour and configure a balancing experiment.")
 parser_balance.set_defaults(func=monitor)
+parser_loadtest = subparsers.add_parser("loadtest", help="Simulate many positions polling a local stub minoTour,"
+                                                         " and report latency, throughput and resource use.")
+parser_loadtest.set_defaults(func=loadtest)
+parser_reanalyse = subparsers.add_parser("reanalyse", help="Replay archived breakpoints snapshots through the target"
+                                                           " merging, sweeping over behaviour parameters.")
+parser_reanalyse.set_defaults(func=reanalyse)
 parser.add_argument(
-    "--mt-key", default=None, help="Access token for MinoTour", required=True
+    "--mt-key", default=None, help="Access token for MinoTour. Required for balance and breakpoints"
 )
 parser.add_argument(
     "--mk-host", default="localhost", help="Address for connecting to MinKNOW",
@@ -55,7 +70,7 @@ parser.add_argument(
     type=int,
     help="Port for connecting to minotour. Default - 8100.",
 )
-parser.add_argument("--device", type=str, required=True, help="MinION device or GridION position")
+parser.add_argument("--device", type=str, help="MinION device or GridION position. Required unless --run-id is given")
 parser.add_argument("--toml", type=Path, required=True, help="Path to TOML file that will be updated")
 parser.add_argument(
     "--run-id",
@@ -63,6 +78,30 @@ parser.add_argument(
     help="For testing - skips minknow validation. Not recommended."
     " Will be deprecated in favour of a mock minknow server for testing.",
 )
+parser.add_argument(
+    "--run-until",
+    default=None,
+    choices=["stop", "notify"],
+    help="Once all barcodes are complete, stop the protocol in MinKNOW, or just notify in the log. Default - off",
+)
+parser.add_argument(
+    "--run-until-fraction",
+    default=1.0,
+    type=float,
+    help="Fraction of barcodes that must be complete for run until to act. Default 1.",
+)
+parser.add_argument(
+    "--expected-barcodes",
+    default=None,
+    help="Comma separated barcodes run until waits for, whether or not minoTour has reported them yet. "
+         "Default - the barcode conditions in --toml. Required for --run-until stop if there are none.",
+)
+parser_balance.add_argument(
+    "--amplicons",
+    default=None,
+    type=int,
+    help="Number of amplicons in the scheme. A barcode is complete for run until once all of them are over the threshold.",
+)
 parser_balance.add_argument(
     "--threshold",
     default=50,
@@ -87,6 +126,49 @@ parser_breakpoints.add_argument(
     type=int,
     help="Expected estimated number of reads to be in a bin. Default 100."
 )
+parser_breakpoints.add_argument(
+    "--stable-polls",
+    default=5,
+    type=int,
+    help="Number of polls a barcode's targets must be unchanged for to be complete for run until. Default 5."
+)
+parser_breakpoints.add_argument(
+    "--merge-workers",
+    default=1,
+    type=int,
+    help="Number of processes to merge new targets into each barcode's existing targets with. Default 1, no pool."
+)
+parser_breakpoints.add_argument(
+    "--parallel-threshold",
+    default=DEFAULT_THRESHOLD,
+    type=int,
+    help=f"Number of targets on changed barcodes below which merging stays in one process. Default {DEFAULT_THRESHOLD}."
+)
+parser_breakpoints.add_argument(
+    "--incremental",
+    action="store_true",
+    help="Accrue targets across polls, rather than merging each poll with the barcodes in --toml only. "
+         "Unbounded unless --max-target-age, --max-targets or --max-barcode-bytes is given, each of which implies it."
+)
+parser_breakpoints.add_argument(
+    "--max-target-age",
+    default=None,
+    type=int,
+    help="Age out targets minoTour has not reported for this many polls. Default - never."
+)
+parser_breakpoints.add_argument(
+    "--max-targets",
+    default=None,
+    type=int,
+    help="Maximum number of targets per barcode, the least recently reported are evicted first. Default - unlimited."
+)
+parser_breakpoints.add_argument(
+    "--max-barcode-bytes",
+    default=None,
+    type=int,
+    help="Maximum size in bytes of each barcode's targets in the TOML, the least recently reported are evicted first."
+         " Default - unlimited."
+)
 parser_breakpoints.add_argument(
     "--behave-toml",
     required=True,
@@ -96,6 +178,136 @@ parser_breakpoints.add_argument(
     help="Path to toml file containing desired behaviour for barcodes on mapping matches, "
          "and min and max allowed chunk sizes. An example can be found in chunkalicious.toml "
 )
+parser_loadtest.add_argument(
+    "--positions",
+    default=8,
+    type=int,
+    help="Number of simulated positions polling minoTour at once. Default 8."
+)
+parser_loadtest.add_argument(
+    "--polls",
+    default=10,
+    type=int,
+    help="Number of polls each simulated position makes. Default 10."
+)
+parser_loadtest.add_argument(
+    "--interval",
+    default=1.0,
+    type=float,
+    help="Seconds between polls on each simulated position. Default 1."
+)
+parser_loadtest.add_argument(
+    "--mode",
+    default="balance",
+    choices=["balance", "breakpoints"],
+    help="Which monitor logic the simulated positions run. Default balance."
+)
+parser_loadtest.add_argument(
+    "--barcodes",
+    default=96,
+    type=int,
+    help="Number of barcodes in each payload returned by the stub minoTour. Default 96."
+)
+parser_loadtest.add_argument(
+    "--targets",
+    default=100,
+    type=int,
+    help="Number of targets per barcode in each payload returned by the stub minoTour. Default 100."
+)
+parser_loadtest.add_argument(
+    "--latency",
+    default=0,
+    type=float,
+    help="Latency in milliseconds injected into every stub minoTour response. Default 0."
+)
+parser_loadtest.add_argument(
+    "--threshold",
+    default=50,
+    type=int,
+    help="Threshold passed to the stub minoTour in balance mode. Default 50."
+)
+parser_loadtest.add_argument(
+    "--behave-toml",
+    default=Path("chunkalicious.toml"),
+    type=Path,
+    dest="b_toml",
+    help="Path to the behaviour toml used in breakpoints mode. Default chunkalicious.toml."
+)
+parser_loadtest.add_argument(
+    "--merge-workers",
+    default=1,
+    type=int,
+    help="Number of processes each position merges breakpoints targets with. Default 1, no pool."
+)
+parser_loadtest.add_argument(
+    "--parallel-threshold",
+    default=DEFAULT_THRESHOLD,
+    type=int,
+    help=f"Number of targets on changed barcodes below which merging stays in one process. Default {DEFAULT_THRESHOLD}."
+)
+parser_loadtest.add_argument(
+    "--incremental",
+    action="store_true",
+    help="Accrue breakpoints targets across polls on each position, rather than merging each poll with --toml."
+)
+parser_loadtest.add_argument(
+    "--run-until",
+    action="store_true",
+    help="Track barcode completion for run until on each position, notifying only."
+)
+parser_loadtest.add_argument(
+    "--stub-port",
+    default=0,
+    type=int,
+    help="Port for the stub minoTour to listen on. Default - any free port."
+)
+parser_reanalyse.add_argument(
+    "archive",
+    nargs="+",
+    type=Path,
+    help="Run directories of timestamped snapshots, or directories containing them"
+)
+parser_reanalyse.add_argument(
+    "--behave-toml",
+    nargs="+",
+    default=[Path("chunkalicious.toml")],
+    type=Path,
+    dest="b_tomls",
+    help="Behaviour tomls to sweep over. Default chunkalicious.toml."
+)
+parser_reanalyse.add_argument(
+    "--min-chunks",
+    nargs="+",
+    type=int,
+    help="min_chunks values to sweep over, overriding the behaviour toml. Default - as in the behaviour toml"
+)
+parser_reanalyse.add_argument(
+    "--max-chunks",
+    nargs="+",
+    type=int,
+    help="max_chunks values to sweep over, overriding the behaviour toml. Default - as in the behaviour toml"
+)
+parser_reanalyse.add_argument(
+    "--merge",
+    nargs="+",
+    default=["union"],
+    choices=["union", "replace", "accumulate"],
+    help="How each poll's targets are merged. union merges them with the barcodes in --toml, as a live run does, "
+         "replace keeps only the new targets, and accumulate accrues them across polls as --incremental does. "
+         "Default union."
+)
+parser_reanalyse.add_argument(
+    "--workers",
+    default=None,
+    type=int,
+    help="Number of processes to reanalyse with. Default - one per CPU."
+)
+parser_reanalyse.add_argument(
+    "--out",
+    default=Path("reanalysis.tsv"),
+    type=Path,
+    help="Path to write the tab separated summary to. Default reanalysis.tsv."
+)
 
 
 def signal_handler(signal, frame):
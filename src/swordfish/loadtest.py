@@ -0,0 +1,382 @@
+"""
+Load test swordfish against a local stub minoTour, simulating many sequencing positions polling at once
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from rich.console import Console
+from rich.logging import RichHandler
+from rich.table import Table
+
+from swordfish.minotour_api import MinotourAPI
+from swordfish.monitor import build_merger, poll_once
+from swordfish.run_until import RunUntil
+from swordfish.utils import validate_mt_connection
+
+formatter = logging.Formatter(
+        "[%(asctime)s] %(levelname)s - %(message)s", "%Y-%m-%d %H:%M:%S"
+    )
+handler = RichHandler()
+handler.setFormatter(formatter)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(handler)
+console = Console()
+
+API_ROOT = "/api/v1"
+# Regexes for the minoTour endpoints swordfish polls, see swordfish.endpoints.EndPoint
+ROUTES = {
+    "test": re.compile(r"^/readfish/swordfish/test-connect/$"),
+    "run": re.compile(r"^/readfish/swordfish/(?P<run_id>[^/]+)/validate/run/[^/]+$"),
+    "task": re.compile(r"^/readfish/swordfish/[^/]+/validate/task/[^/]+$"),
+    "coords": re.compile(r"^/readfish/swordfish/[^/]+/chopchop/[^/]+$"),
+    "task_info": re.compile(r"^/alignment/get_task/[^/]+$"),
+    "breakpoints": re.compile(r"^/alignment/breakpoints/[^/]+/[^/]+/[^/]+/[^/]+$"),
+}
+
+
+def build_conditions(n_barcodes, n_targets):
+    """
+    Build a conditions payload shaped like the one minoTour returns, for n_barcodes barcodes with n_targets each
+    Parameters
+    ----------
+    n_barcodes: int
+        Number of barcodes to include
+    n_targets: int
+        Number of targets on each barcode
+
+    Returns
+    -------
+    dict
+        Barcode names keyed to their readfish conditions
+    """
+    conditions = {}
+    for i in range(1, n_barcodes + 1):
+        barcode = f"barcode{i:02d}"
+        conditions[barcode] = {
+            "name": barcode,
+            "control": False,
+            "min_chunks": 0,
+            "max_chunks": 4,
+            "targets": [f"chr{j % 22 + 1},{j * 1000},{j * 1000 + 400},+" for j in range(n_targets)],
+            "single_on": "unblock",
+            "multi_on": "unblock",
+            "single_off": "stop_receiving",
+            "multi_off": "stop_receiving",
+            "no_seq": "proceed",
+            "no_map": "proceed",
+        }
+    return conditions
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """
+    Answer the subset of the minoTour API that swordfish uses
+    """
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self, body=b"", status=200, headers=None):
+        self.server.record_request()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _route(self):
+        path = self.path.split("?", 1)[0]
+        if not path.startswith(API_ROOT):
+            return None, None
+        path = path[len(API_ROOT):]
+        for name, pattern in ROUTES.items():
+            match = pattern.match(path)
+            if match:
+                return name, match
+        return None, None
+
+    def do_HEAD(self):
+        name, _ = self._route()
+        if name == "test":
+            self._respond(headers={"x-sf-version": self.server.sf_version, "x-mt-version": "loadtest"})
+        else:
+            self._respond(status=404)
+
+    def do_GET(self):
+        name, match = self._route()
+        if name == "run":
+            body = json.dumps({"name": match.group("run_id"), "flowcell": 1}).encode()
+        elif name in {"task", "task_info"}:
+            body = b'{"id": 1}'
+        elif name in {"coords", "breakpoints"}:
+            body = self.server.payload
+        else:
+            self._respond(status=404)
+            return
+        self._respond(body)
+
+    def log_message(self, format, *args):
+        # Don't spam stderr with a line per request
+        pass
+
+
+class StubMinotour(ThreadingHTTPServer):
+    """
+    Local stand-in for minoTour, serving a fixed conditions payload with optional injected latency
+    """
+    daemon_threads = True
+
+    def __init__(self, sf_version, payload, latency=0.0, host="localhost", port=0):
+        """
+        Parameters
+        ----------
+        sf_version: str
+            The swordfish version to report as compatible
+        payload: dict
+            The conditions returned by the GET_COORDS and BREAKPOINTS endpoints
+        latency: float
+            Seconds to wait before answering each request
+        host: str
+            Address to bind to
+        port: int
+            Port to bind to, 0 picks a free port
+        """
+        super().__init__((host, port), _StubHandler)
+        self.sf_version = sf_version
+        self.payload = json.dumps(payload).encode()
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile of a list of values
+    Parameters
+    ----------
+    values: list[float]
+        The values
+    pct: float
+        The percentile to return, between 0 and 100
+
+    Returns
+    -------
+    float
+        The percentile, or 0 if there are no values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _position_args(args, index, work_dir):
+    """
+    Build the argument namespace monitor would receive for one simulated position
+    """
+    return argparse.Namespace(
+        subparser_name=args.mode,
+        toml=work_dir / args.toml.name,
+        mt_key="loadtest",
+        mt_host=args.mt_host,
+        mt_port=args.mt_port,
+        freq=args.interval,
+        device=f"SIM{index:03d}",
+        run_id=f"loadtest-{index:03d}",
+        threshold=args.threshold,
+        reads_bin=100,
+        exp_ploidy=2,
+        min_diff=4,
+        b_toml=args.b_toml,
+        merge_workers=args.merge_workers,
+        parallel_threshold=args.parallel_threshold,
+        incremental=args.incremental,
+        max_target_age=None,
+        max_targets=None,
+        max_barcode_bytes=None,
+    )
+
+
+def _simulate_position(index, args, work_dir, sf_version, results):
+    """
+    Run the monitor polling logic for one simulated position, and put its measurements on the results queue
+    """
+    # Logging a line per barcode per poll swamps the measurements, keep warnings and above
+    for name in ("swordfish.monitor", "swordfish.utils", "swordfish.accumulator"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    # Breakpoints mode archives each poll into a directory named for the run, relative to the working directory
+    os.chdir(work_dir)
+    pos_args = _position_args(args, index, work_dir)
+    shutil.copy(args.toml, pos_args.toml)
+    live_file = Path(f"{pos_args.toml}_live")
+    mt_api = MinotourAPI(host_address=args.mt_host, port_number=args.mt_port, api_key=pos_args.mt_key)
+    validate_mt_connection(mt_api, version=sf_version)
+    # Stagger the positions across the interval, as real runs are not started in lockstep
+    time.sleep(index * args.interval / args.positions)
+    merger, accumulator = build_merger(pos_args)
+    run_until = None
+    if args.run_until:
+        # Notify only, every barcode in the stub payload is complete with all of its targets
+        run_until = RunUntil(args.mode, amplicons=max(args.targets, 1), stable_polls=1)
+    latencies, write_times, bytes_written = [], [], 0
+    for _ in range(args.polls):
+        poll_start = time.perf_counter()
+        timings = {}
+        status, criteria_met = poll_once(
+            pos_args, mt_api, pos_args.run_id, merger=merger, accumulator=accumulator, run_until=run_until,
+            timings=timings,
+        )
+        if criteria_met:
+            run_until = None
+        if "fetch" in timings:
+            latencies.append(timings["fetch"])
+        if status == 200:
+            write_times.append(timings["write"])
+            bytes_written += live_file.stat().st_size
+        time.sleep(max(args.interval - (time.perf_counter() - poll_start), 0))
+    if merger is not None:
+        # Shutting the pool down waits for its workers, so their usage is counted under RUSAGE_CHILDREN below
+        merger.close()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    results.put({
+        "position": pos_args.device,
+        "latencies": latencies,
+        "write_times": write_times,
+        "bytes_written": bytes_written,
+        "cpu": usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime,
+        # ru_maxrss is in KiB on Linux. For the children it is the peak of the largest merge worker
+        "rss": (usage.ru_maxrss + children.ru_maxrss) / 1024,
+    })
+
+
+def _report(results, requests, elapsed):
+    """
+    Print a per position table and the fleet wide summary
+    """
+    table = Table(title="swordfish load test")
+    for column in ("position", "polls", "p50 ms", "p95 ms", "p99 ms", "CPU s", "peak RSS MiB", "TOML MiB/s"):
+        table.add_column(column, justify="right")
+    all_latencies, all_write_time, all_bytes = [], 0.0, 0
+    for result in sorted(results, key=lambda r: r["position"]):
+        latencies = result["latencies"]
+        write_time = sum(result["write_times"])
+        all_latencies.extend(latencies)
+        all_write_time += write_time
+        all_bytes += result["bytes_written"]
+        throughput = result["bytes_written"] / 2 ** 20 / write_time if write_time else 0.0
+        table.add_row(
+            result["position"],
+            str(len(latencies)),
+            *(f"{percentile(latencies, pct) * 1000:.1f}" for pct in (50, 95, 99)),
+            f"{result['cpu']:.2f}",
+            f"{result['rss']:.1f}",
+            f"{throughput:.2f}",
+        )
+    console.print(table)
+    throughput = all_bytes / 2 ** 20 / all_write_time if all_write_time else 0.0
+    console.print(
+        f"Polls: {len(all_latencies)}  "
+        f"latency p50/p95/p99: "
+        f"{' / '.join(f'{percentile(all_latencies, pct) * 1000:.1f}' for pct in (50, 95, 99))} ms  "
+        f"requests/s: {requests / elapsed:.1f}  "
+        f"TOML write throughput: {throughput:.2f} MiB/s  "
+        f"wall time: {elapsed:.1f} s"
+    )
+
+
+def loadtest(args, sf_version):
+    """
+    Spin up a stub minoTour and a number of simulated positions polling it, then report how swordfish coped
+    Parameters
+    ----------
+    args: argparse.Namespace
+        The argument parser options
+    sf_version: str
+        The version of swordfish package
+
+    Returns
+    -------
+    None
+    """
+    if not args.toml.is_file():
+        raise FileNotFoundError(args.toml)
+    if args.mode == "breakpoints" and not args.b_toml.is_file():
+        raise FileNotFoundError(args.b_toml)
+    # The simulated positions each run in their own working directory
+    args.toml, args.b_toml = args.toml.resolve(), args.b_toml.resolve()
+    payload = build_conditions(args.barcodes, args.targets)
+    server = StubMinotour(sf_version, payload, latency=args.latency / 1000, port=args.stub_port)
+    server.start()
+    args.mt_host, args.mt_port = "localhost", server.server_address[1]
+    logger.info(
+        f"Stub minoTour listening on port {args.mt_port}, serving {args.barcodes} barcodes x {args.targets} targets "
+        f"({len(server.payload) / 2 ** 20:.2f} MiB) with {args.latency} ms latency"
+    )
+    # Spawn rather than fork, as the stub server threads are running in this process
+    ctx = multiprocessing.get_context("spawn")
+    results_queue = ctx.Queue()
+    with tempfile.TemporaryDirectory(prefix="swordfish_loadtest_") as tmp_dir:
+        processes = []
+        start = time.perf_counter()
+        results = []
+        # Not daemonic, as positions merging with --merge-workers start a process pool of their own
+        try:
+            for index in range(args.positions):
+                work_dir = Path(tmp_dir) / f"position_{index:03d}"
+                work_dir.mkdir()
+                process = ctx.Process(target=_simulate_position, args=(index, args, work_dir, sf_version, results_queue))
+                process.start()
+                processes.append(process)
+            logger.info(f"Started {args.positions} simulated positions, {args.polls} polls each every {args.interval}s")
+            while len(results) < args.positions and any(p.is_alive() for p in processes):
+                try:
+                    results.append(results_queue.get(timeout=1))
+                except queue.Empty:
+                    continue
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            server.stop()
+        elapsed = time.perf_counter() - start
+    if len(results) < args.positions:
+        logger.error(
+            f"Only {len(results)} of {args.positions} simulated positions finished, "
+            f"see the tracebacks from the failed positions above"
+        )
+    _report(results, server.requests, elapsed)
@@ -6,10 +6,13 @@ from pprint import pformat
 from rich.logging import RichHandler
 from rich.console import Console
 
+from swordfish.accumulator import TargetAccumulator
 from swordfish.endpoints import EndPoint
 from swordfish.minotour_api import MinotourAPI
+from swordfish.parallel_merge import ParallelMerger
+from swordfish.run_until import RunUntil
 from swordfish.utils import validate_mt_connection, write_toml_file, get_original_toml_settings, get_device, get_run_id, \
-    update_extant_targets, _get_preset_behaviours, create_toml_data_directory, write_out_timestamped_toml
+    stop_protocol, update_extant_targets, _get_preset_behaviours, create_toml_data_directory, write_out_timestamped_toml
 
 from grpc import RpcError
 DEFAULT_FREQ = 60
@@ -66,20 +69,16 @@ def monitor(args, sf_version):
     mt_host = args.mt_host
     run_id = args.run_id
     mt_port = args.mt_port
-    artic = True
-    if args.subparser_name == "balance":
-        threshold = args.threshold
-    else:
-        artic = False
-        reads_per_bin = args.reads_bin
-        exp_ploidy = args.exp_ploidy
-        min_diff = args.min_diff
+    artic = args.subparser_name == "balance"
     if not args.toml.is_file():
         sys.exit(f"TOML file not found at {args.toml}")
 
     # Check MinoTour key is provided
-    if args.mt_key is None and not args.simple:
+    if args.mt_key is None:
         sys.exit("No MinoTour access token provided")
+    # Check we can find the run id, either from MinKNOW or as provided
+    if not args.device and not args.run_id:
+        sys.exit("--device is required to fetch the run id from MinKNOW, unless --run-id is provided")
 
     # Check MinoTour polling frequency
     # todo, move checks into utils
@@ -89,6 +88,43 @@ def monitor(args, sf_version):
         if args.threshold > 1000:
             sys.exit("-t/--threshold cannot be more than 1000")
 
+    # Check the TOML files up front, rather than failing part way through a run
+    try:
+        _, toml_barcodes = get_original_toml_settings(toml_file)
+        if not artic:
+            _get_preset_behaviours(args.b_toml)
+    except (ValueError, FileNotFoundError) as e:
+        sys.exit(str(e))
+
+    run_until = None
+    if args.run_until:
+        if not 0 < args.run_until_fraction <= 1:
+            sys.exit("--run-until-fraction must be more than 0 and at most 1")
+        # Stopping can't be undone, so it waits on every barcode expected, not just those minoTour has reported
+        if args.expected_barcodes:
+            expected_barcodes = [barcode.strip() for barcode in args.expected_barcodes.split(",") if barcode.strip()]
+        else:
+            expected_barcodes = list(toml_barcodes)
+        if args.run_until == "stop" and not expected_barcodes:
+            sys.exit(
+                f"--run-until stop needs the barcodes to wait for. Give them with --expected-barcodes, "
+                f"or add a condition for each barcode to {toml_file}"
+            )
+        try:
+            run_until = RunUntil(
+                args.subparser_name,
+                amplicons=args.amplicons if artic else None,
+                stable_polls=None if artic else args.stable_polls,
+                barcode_fraction=args.run_until_fraction,
+                expected_barcodes=expected_barcodes,
+            )
+        except ValueError as e:
+            sys.exit(str(e))
+        if args.run_until == "stop" and args.run_id:
+            logger.warning("--run-id given, so swordfish cannot stop the protocol in MinKNOW. Run until will only notify.")
+
+    merger, accumulator = build_merger(args)
+
     mt_api = MinotourAPI(host_address=mt_host, port_number=mt_port, api_key=mt_key)
     validate_mt_connection(mt_api, version=sf_version)
     # Get run id from minknow
@@ -97,43 +133,160 @@ def monitor(args, sf_version):
         # Polling loop
         # Poll for update
 
-        og_settings_dict, _ = get_original_toml_settings(toml_file)
-        # Check run is present in minoTour
-        run_json, status = mt_api.get_json(EndPoint.VALIDATE_TASK, run_id=run_id, second_slug="run", third_slug=args.subparser_name)
-        if status == 404:
-            logger.warning(f"Run with id {run_id} not found. Trying again in {frequency} seconds.")
-            time.sleep(frequency)
-            continue
-        logger.info(pformat(run_json))
-        job_json, status = mt_api.get_json(EndPoint.VALIDATE_TASK, run_id=run_id, second_slug="task", third_slug=args.subparser_name)
-        if status == 404:
-            # Todo attempt to start a task ourselves
-            task = "Artic" if artic else "Minimap2+CNV"
-            logger.warning(f"{task} task not found for run {run_json['name']}.\n"
-                           f"Please start one in the minoTour interface. Checking again in {frequency} seconds.")
-            time.sleep(frequency)
-            continue
-        # Todo at this point post the original toml
-        if artic:
-            logger.info("Run information and Artic task found in minoTour. Fetching TOML information...")
-            data, status = mt_api.get_json(EndPoint.GET_COORDS, run_id=run_id, threshold=threshold)
-        else:
-            # check for behaviours provided, and if there are none, use as provided by minoTour
-            data_dir = create_toml_data_directory(run_json["name"])
-            logger.info(f"{args.b_toml} provided for behaviour.")
-            behaviours = _get_preset_behaviours(args.b_toml)
-            logger.info("Run information and Minimap + CNV task found in minoTour. Fetching task information...")
-            job_master_data, status = mt_api.get_json(EndPoint.TASK_INFO, swordify=False, flowcell_pk=run_json["flowcell"])
-            logger.info("Run information and Minimap + CNV task information retrieved. Fetching TOML information...")
-            data, status = mt_api.get_json(EndPoint.BREAKPOINTS, swordify=False, job_master_pk=job_master_data["id"], reads_per_bin=reads_per_bin, exp_ploidy=exp_ploidy, min_diff=min_diff)
-            # write the json into the data dir
-            write_out_timestamped_toml(data, data_dir)
-            data = update_extant_targets(data, args.toml, behaviours)
-        if status == 200:
-            og_settings_dict["conditions"].update(data)
-            write_toml_file(og_settings_dict, toml_file)
-
-        elif status == 204:
-            logger.warning(f"No barcodes found in minoTour for this ARTIC task. Trying again in {frequency} seconds.")
+        _, criteria_met = poll_once(args, mt_api, run_id, merger=merger, accumulator=accumulator, run_until=run_until)
+        if criteria_met:
+            logger.warning(f"Run until criteria met. Incomplete barcodes: {run_until.incomplete_barcodes() or 'none'}")
+            if args.run_until == "stop" and not args.run_id:
+                if stop_protocol(args):
+                    if merger is not None:
+                        merger.close()
+                    return
+                logger.warning(f"Could not stop the protocol, trying again in {frequency} seconds.")
+            else:
+                # Only notify once
+                run_until = None
 
         time.sleep(frequency)
+
+
+def build_merger(args):
+    """
+    Build the engine that merges each poll's breakpoints targets into those we already have
+    Parameters
+    ----------
+    args: argparse.Namespace
+        The argument parser options
+
+    Returns
+    -------
+    tuple[swordfish.parallel_merge.ParallelMerger, swordfish.accumulator.TargetAccumulator]
+        The parallel merger and the incremental accumulator, either or both of which may be None
+    """
+    if args.subparser_name != "breakpoints":
+        return None, None
+    if args.incremental or args.max_target_age or args.max_targets or args.max_barcode_bytes:
+        for option in ("max_target_age", "max_targets", "max_barcode_bytes"):
+            if getattr(args, option) is not None and getattr(args, option) < 1:
+                sys.exit(f"--{option.replace('_', '-')} must be at least 1")
+        if not (args.max_target_age or args.max_targets or args.max_barcode_bytes):
+            logger.warning(
+                "--incremental accrues every target minoTour reports for the rest of the run. "
+                "Bound it with --max-target-age, --max-targets or --max-barcode-bytes."
+            )
+        if args.merge_workers > 1:
+            logger.warning("--merge-workers is not used when accumulating targets incrementally.")
+        _, existing_barcodes = get_original_toml_settings(args.toml)
+        accumulator = TargetAccumulator(
+            existing_barcodes,
+            max_age=args.max_target_age,
+            max_targets=args.max_targets,
+            max_bytes=args.max_barcode_bytes,
+        )
+        return None, accumulator
+    if args.merge_workers > 1:
+        return ParallelMerger(args.merge_workers, threshold=args.parallel_threshold), None
+    return None, None
+
+
+def poll_once(args, mt_api, run_id, merger=None, accumulator=None, run_until=None, timings=None):
+    """
+    Poll minoTour once, and write what it returns into the live TOML file
+    Parameters
+    ----------
+    args: argparse.Namespace
+        The argument parser options
+    mt_api: swordfish.minotour_api.MinotourAPI
+        Convenience class for querying minoTour
+    run_id: str
+        The run id UUID
+    merger: swordfish.parallel_merge.ParallelMerger
+        Merge the breakpoints targets across a pool of processes, if provided
+    accumulator: swordfish.accumulator.TargetAccumulator
+        Accumulate the breakpoints targets incrementally across polls, if provided
+    run_until: swordfish.run_until.RunUntil
+        Track barcode completion for run until, if provided
+    timings: dict
+        If provided, the seconds spent fetching from minoTour and writing the TOML are set under fetch and write
+
+    Returns
+    -------
+    tuple[int, bool]
+        The status code of the last request to minoTour, and whether the run until criteria have been met
+    """
+    og_settings_dict, _ = get_original_toml_settings(args.toml)
+    fetch_start = time.perf_counter()
+    data, status = fetch_conditions(args, mt_api, run_id, merger=merger, accumulator=accumulator)
+    if timings is not None:
+        timings["fetch"] = time.perf_counter() - fetch_start
+    criteria_met = False
+    if status == 200:
+        write_start = time.perf_counter()
+        og_settings_dict["conditions"].update(data)
+        write_toml_file(og_settings_dict, args.toml)
+        if timings is not None:
+            timings["write"] = time.perf_counter() - write_start
+        if run_until is not None:
+            criteria_met = run_until.update(data)
+            logger.info(f"Run until: {run_until.n_complete}/{len(run_until.complete)} barcodes complete.")
+
+    elif status == 204:
+        logger.warning(f"No barcodes found in minoTour for this ARTIC task. Trying again in {args.freq} seconds.")
+    return status, criteria_met
+
+
+def fetch_conditions(args, mt_api, run_id, merger=None, accumulator=None):
+    """
+    Poll minoTour once for the conditions that should be written into the live TOML file
+    Parameters
+    ----------
+    args: argparse.Namespace
+        The argument parser options
+    mt_api: swordfish.minotour_api.MinotourAPI
+        Convenience class for querying minoTour
+    run_id: str
+        The run id UUID
+    merger: swordfish.parallel_merge.ParallelMerger
+        Merge the breakpoints targets across a pool of processes, if provided
+    accumulator: swordfish.accumulator.TargetAccumulator
+        Accumulate the breakpoints targets incrementally across polls, if provided. Takes precedence over merger
+
+    Returns
+    -------
+    tuple[dict, int]
+        The conditions returned by minoTour (None if the run or task is not found yet), and the status code
+    """
+    frequency = args.freq
+    artic = args.subparser_name == "balance"
+    # Check run is present in minoTour
+    run_json, status = mt_api.get_json(EndPoint.VALIDATE_TASK, run_id=run_id, second_slug="run", third_slug=args.subparser_name)
+    if status == 404:
+        logger.warning(f"Run with id {run_id} not found. Trying again in {frequency} seconds.")
+        return None, status
+    logger.info(pformat(run_json))
+    job_json, status = mt_api.get_json(EndPoint.VALIDATE_TASK, run_id=run_id, second_slug="task", third_slug=args.subparser_name)
+    if status == 404:
+        # Todo attempt to start a task ourselves
+        task = "Artic" if artic else "Minimap2+CNV"
+        logger.warning(f"{task} task not found for run {run_json['name']}.\n"
+                       f"Please start one in the minoTour interface. Checking again in {frequency} seconds.")
+        return None, status
+    # Todo at this point post the original toml
+    if artic:
+        logger.info("Run information and Artic task found in minoTour. Fetching TOML information...")
+        data, status = mt_api.get_json(EndPoint.GET_COORDS, run_id=run_id, threshold=args.threshold)
+    else:
+        # check for behaviours provided, and if there are none, use as provided by minoTour
+        data_dir = create_toml_data_directory(run_json["name"])
+        logger.info(f"{args.b_toml} provided for behaviour.")
+        behaviours = _get_preset_behaviours(args.b_toml)
+        logger.info("Run information and Minimap + CNV task found in minoTour. Fetching task information...")
+        job_master_data, status = mt_api.get_json(EndPoint.TASK_INFO, swordify=False, flowcell_pk=run_json["flowcell"])
+        logger.info("Run information and Minimap + CNV task information retrieved. Fetching TOML information...")
+        data, status = mt_api.get_json(EndPoint.BREAKPOINTS, swordify=False, job_master_pk=job_master_data["id"], reads_per_bin=args.reads_bin, exp_ploidy=args.exp_ploidy, min_diff=args.min_diff)
+        # write the json into the data dir
+        write_out_timestamped_toml(data, data_dir)
+        if accumulator is not None:
+            data = accumulator.update(data, behaviours)
+        else:
+            data = update_extant_targets(data, args.toml, behaviours, merger=merger)
+    return data, status
@@ -0,0 +1,148 @@
+"""
+Merge the targets of very large barcode panels across a pool of processes
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+from swordfish.utils import merge_barcode
+
+DEFAULT_THRESHOLD = 200000
+
+
+def _freeze(conditions):
+    """
+    Hashable, comparable copy of a barcodes conditions, used to tell if it has changed since the last poll
+    """
+    if conditions is None:
+        return None
+    return tuple((key, tuple(value) if isinstance(value, list) else value) for key, value in conditions.items())
+
+
+def _copy_conditions(conditions):
+    """
+    Copy of a barcodes conditions with its own targets list, so the cached results cannot be changed through the output
+    """
+    conditions = dict(conditions)
+    if isinstance(conditions.get("targets"), list):
+        conditions["targets"] = list(conditions["targets"])
+    return conditions
+
+
+def _n_targets(item):
+    """
+    Number of targets to be merged for a (barcode, conditions, existing conditions) item
+    """
+    _, conditions, existing = item
+    return len(conditions.get("targets", [])) + len(existing.get("targets", []) if existing else [])
+
+
+def _merge_shard(shard, behaviours):
+    """
+    Merge a shard of barcodes in a worker process
+    Parameters
+    ----------
+    shard: list[tuple[str, dict, dict]]
+        The barcode name, its new conditions and its existing conditions, for each barcode in the shard
+    behaviours: dict
+        dict containing behaviours as provided
+    Returns
+    -------
+    list[tuple[str, dict]]
+        The barcode names and their merged conditions
+    """
+    return [(barcode, merge_barcode(conditions, existing, behaviours)) for barcode, conditions, existing in shard]
+
+
+class ParallelMerger:
+    """
+    Merge new targets into the existing targets of each barcode, sharding the barcodes across a pool of processes.
+
+    Barcodes whose new and existing conditions are the same as on the last poll are not merged again, the last result
+    is reused. If the changed barcodes have fewer than threshold targets between them they are merged in this process,
+    as the work is not worth sending to the pool. The output is identical to utils.merge_targets.
+    """
+
+    def __init__(self, workers, threshold=DEFAULT_THRESHOLD):
+        """
+        Parameters
+        ----------
+        workers: int
+            Number of worker processes
+        threshold: int
+            Number of targets across the changed barcodes below which the merge is done serially
+        """
+        self.workers = workers
+        self.threshold = threshold
+        self._executor = None
+        self._behaviours = None
+        self._cache = {}
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _shards(self, changed):
+        """
+        Split the changed barcodes into shards of roughly equal numbers of targets, a few per worker
+        """
+        n_shards = min(self.workers * 4, len(changed))
+        shards = [[] for _ in range(n_shards)]
+        sizes = [0] * n_shards
+        # Largest first onto the smallest shard keeps the shards even
+        for item in sorted(changed, key=_n_targets, reverse=True):
+            smallest = sizes.index(min(sizes))
+            shards[smallest].append(item)
+            sizes[smallest] += _n_targets(item) + 1
+        return [shard for shard in shards if shard]
+
+    def merge(self, new_data, existing_barcodes, behaviours):
+        """
+        Merge the targets fetched from minoTour this iteration into those we already have, and apply the behaviours
+        Parameters
+        ----------
+        new_data: dict
+            Data that has been fetched from minoTour this iteration
+        existing_barcodes: dict
+            Barcode names keyed to the conditions we already have for them
+        behaviours: dict
+            dict containing behaviours as provided
+        Returns
+        -------
+        dict
+            Data to be written to the toml file
+        """
+        if behaviours != self._behaviours:
+            self._cache = {}
+            self._behaviours = behaviours
+        merged, changed, keys = {}, [], {}
+        for barcode, conditions in new_data.items():
+            existing = existing_barcodes.get(barcode)
+            key = (_freeze(conditions), _freeze(existing))
+            cached = self._cache.get(barcode)
+            if cached is not None and cached[0] == key:
+                merged[barcode] = _copy_conditions(cached[1])
+            else:
+                keys[barcode] = key
+                changed.append((barcode, conditions, existing))
+        # Barcodes we have no existing conditions for only need the behaviours applying, which is not worth sending out
+        to_union = [item for item in changed if item[2] is not None]
+        if self.workers > 1 and len(to_union) > 1 and sum(map(_n_targets, to_union)) >= self.threshold:
+            futures = [self._pool().submit(_merge_shard, shard, behaviours) for shard in self._shards(to_union)]
+            results = _merge_shard([item for item in changed if item[2] is None], behaviours)
+            results.extend(result for future in futures for result in future.result())
+        else:
+            results = _merge_shard(changed, behaviours)
+        for barcode, conditions in results:
+            self._cache[barcode] = (keys[barcode], _copy_conditions(conditions))
+            merged[barcode] = conditions
+        # Barcodes that have gone are dropped from the cache, and the output is in the order minoTour sent it
+        self._cache = {barcode: self._cache[barcode] for barcode in new_data}
+        return {barcode: merged[barcode] for barcode in new_data}
+
+    def close(self):
+        """
+        Shut down the worker processes
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
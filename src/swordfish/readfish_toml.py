@@ -0,0 +1,360 @@
+"""
+Fast reading, writing and validation of readfish TOML files.
+
+The generic toml package builds the whole document as one string by repeated concatenation, which dominates the time
+spent writing large target lists. The writer here streams each table and target array straight into the file handle,
+producing byte for byte the same output as toml.dump. The reader parses the subset of TOML used by readfish
+(tables, bare keys, strings, numbers, booleans and arrays), falling back to the toml package for anything else.
+"""
+import json
+import re
+
+import toml
+
+# Actions readfish can take on a read for each unblock_behaviour key
+BEHAVIOUR_ACTIONS = {"unblock", "stop_receiving", "proceed"}
+BEHAVIOUR_KEYS = ("single_on", "single_off", "multi_on", "multi_off", "no_seq", "no_map")
+CHUNK_KEYS = ("min_chunks", "max_chunks")
+CONDITION_KEYS = ("name", "control", "targets") + CHUNK_KEYS + BEHAVIOUR_KEYS
+
+# Used for the rare values that are not plain ASCII strings, bools, ints or lists, so they match toml.dump exactly
+_ENCODER = toml.TomlEncoder()
+# Same pattern as toml.dump, including $ matching before a trailing newline
+_BARE_KEY = re.compile(r"^[A-Za-z0-9_-]+$")
+# Printable ASCII, minus the characters that toml.dump escapes
+_PLAIN_STRING = re.compile(r"[ !#-&(-\[\]-~]*\Z")
+
+_WS = re.compile(r"(?:[ \t]+|#[^\n]*)*")
+_WS_NEWLINE = re.compile(r"(?:[ \t\r\n]+|#[^\n]*)*")
+_TABLE = re.compile(r"\[[ \t]*([A-Za-z0-9_-]+(?:[ \t]*\.[ \t]*[A-Za-z0-9_-]+)*)[ \t]*\]")
+_KEY = re.compile(r"([A-Za-z0-9_-]+)[ \t]*=[ \t]*")
+_BASIC_STRING = re.compile(r'"((?:[^"\\\x00-\x1f]|\\[btnfr"\\]|\\u[0-9A-Fa-f]{4})*)"')
+_LITERAL_STRING = re.compile(r"'([^'\n]*)'")
+_INTEGER = re.compile(r"[+-]?(?:0|[1-9](?:_?[0-9])*)(?![0-9A-Za-z_.:-])")
+_FLOAT = re.compile(
+    r"[+-]?(?:0|[1-9](?:_?[0-9])*)(?:\.[0-9](?:_?[0-9])*(?:[eE][+-]?[0-9](?:_?[0-9])*)?|[eE][+-]?[0-9](?:_?[0-9])*)"
+    r"(?![0-9A-Za-z_.:-])"
+)
+_BOOL = re.compile(r"(true|false)(?![0-9A-Za-z_-])")
+
+
+class _Unsupported(Exception):
+    """
+    Raised by the fast reader on TOML it does not handle, so the generic toml parser is used instead
+    """
+
+
+def dump_value(value):
+    """
+    Format a single value exactly as toml.dump would
+    Parameters
+    ----------
+    value: str or bool or int or float or list
+        The value to format
+
+    Returns
+    -------
+    str
+        The value as it appears in the TOML, escaped and quoted as needed
+    """
+    value_type = type(value)
+    if value_type is str and _PLAIN_STRING.match(value):
+        return f'"{value}"'
+    if value_type is bool:
+        return "true" if value else "false"
+    if value_type is int:
+        return str(value)
+    if value_type is list:
+        return "[" + "".join([f" {dump_value(item)}," for item in value]) + "]"
+    return str(_ENCODER.dump_value(value))
+
+
+def _write_table(fh, table):
+    """
+    Write the key value pairs of a table, returning its sub tables keyed by their quoted names
+    """
+    sub_tables = {}
+    for key, value in table.items():
+        key = str(key)
+        quoted_key = key if _BARE_KEY.match(key) else _ENCODER.dump_value(key)
+        if isinstance(value, dict):
+            sub_tables[quoted_key] = value
+        elif value is None:
+            continue
+        elif type(value) is list and value and type(value[0]) is str:
+            # Target arrays, stream each element rather than joining them all up first
+            fh.write(f"{quoted_key} = [")
+            fh.writelines(
+                f' "{item}",' if type(item) is str and _PLAIN_STRING.match(item) else f" {dump_value(item)},"
+                for item in value
+            )
+            fh.write("]\n")
+        elif isinstance(value, list) and any(isinstance(item, dict) for item in value):
+            raise TypeError(f"Arrays of tables are not supported, found one at {key}")
+        else:
+            fh.write(f"{quoted_key} = {dump_value(value)}\n")
+    return sub_tables
+
+
+def _has_values(table):
+    """
+    Whether toml.dump would write any key value pairs for this table
+    """
+    return any(value is not None and not isinstance(value, dict) for value in table.values())
+
+
+def dump(data, fh):
+    """
+    Write a readfish TOML dictionary to an open file, with output identical to toml.dump
+    Parameters
+    ----------
+    data: dict
+        The TOML data to write
+    fh: io.TextIOBase
+        File handle opened for writing
+
+    Returns
+    -------
+    None
+    """
+    written = _has_values(data)
+    tables = _write_table(fh, data)
+    # toml.dump writes tables breadth first, all tables at one depth before any of their sub tables
+    while tables:
+        sub_tables = {}
+        for name, table in tables.items():
+            if _has_values(table) or not any(isinstance(value, dict) for value in table.values()):
+                fh.write(f"\n[{name}]\n" if written else f"[{name}]\n")
+                written = True
+            for sub_name, sub_table in _write_table(fh, table).items():
+                sub_tables[f"{name}.{sub_name}"] = sub_table
+        tables = sub_tables
+
+
+def _parse_value(text, pos):
+    """
+    Parse the value starting at pos, returning the value and the position after it
+    """
+    char = text[pos:pos + 1]
+    if char == '"':
+        if text.startswith('"""', pos):
+            raise _Unsupported("multi-line string")
+        match = _BASIC_STRING.match(text, pos)
+        if not match:
+            raise _Unsupported("string")
+        value = match.group(1)
+        if "\\" in value:
+            value = json.loads(f'"{value}"')
+        return value, match.end()
+    if char == "'":
+        if text.startswith("'''", pos):
+            raise _Unsupported("multi-line literal string")
+        match = _LITERAL_STRING.match(text, pos)
+        if not match:
+            raise _Unsupported("literal string")
+        return match.group(1), match.end()
+    if char == "[":
+        return _parse_array(text, pos + 1)
+    match = _BOOL.match(text, pos)
+    if match:
+        return match.group(1) == "true", match.end()
+    match = _FLOAT.match(text, pos)
+    if match:
+        return float(match.group().replace("_", "")), match.end()
+    match = _INTEGER.match(text, pos)
+    if match:
+        return int(match.group().replace("_", "")), match.end()
+    raise _Unsupported(f"value at {pos}")
+
+
+def _parse_array(text, pos):
+    """
+    Parse the array whose opening bracket is just before pos, returning the list and the position after it
+    """
+    values = []
+    value_type = None
+    while True:
+        pos = _WS_NEWLINE.match(text, pos).end()
+        if text[pos:pos + 1] == "]":
+            return values, pos + 1
+        value, pos = _parse_value(text, pos)
+        # toml rejects arrays mixing types, let it raise that error
+        if value_type is None:
+            value_type = type(value)
+        elif type(value) is not value_type:
+            raise _Unsupported("mixed type array")
+        values.append(value)
+        pos = _WS_NEWLINE.match(text, pos).end()
+        char = text[pos:pos + 1]
+        if char == ",":
+            pos += 1
+        elif char != "]":
+            raise _Unsupported(f"array at {pos}")
+
+
+def loads(text):
+    """
+    Parse readfish TOML, falling back to the toml package for anything outside the subset readfish uses
+    Parameters
+    ----------
+    text: str
+        The TOML document
+
+    Returns
+    -------
+    dict
+        The parsed TOML
+    """
+    try:
+        return _fast_loads(text)
+    except _Unsupported:
+        return toml.loads(text)
+
+
+def _fast_loads(text):
+    data = {}
+    table = data
+    defined_tables = set()
+    pos, end = 0, len(text)
+    while pos < end:
+        pos = _WS_NEWLINE.match(text, pos).end()
+        if pos >= end:
+            break
+        if text[pos] == "[":
+            match = _TABLE.match(text, pos)
+            if not match or match.group(1) in defined_tables:
+                raise _Unsupported(f"table at {pos}")
+            defined_tables.add(match.group(1))
+            table = data
+            for part in match.group(1).split("."):
+                table = table.setdefault(part.strip(), {})
+                if not isinstance(table, dict):
+                    raise _Unsupported(f"table at {pos}")
+            pos = match.end()
+        else:
+            match = _KEY.match(text, pos)
+            if not match or match.group(1) in table:
+                raise _Unsupported(f"key at {pos}")
+            table[match.group(1)], pos = _parse_value(text, match.end())
+        # Only whitespace or a comment may follow on the same line
+        pos = _WS.match(text, pos).end()
+        if pos < end and text[pos] not in "\r\n":
+            raise _Unsupported(f"trailing characters at {pos}")
+    return data
+
+
+def load(toml_file_path):
+    """
+    Read a readfish TOML file
+    Parameters
+    ----------
+    toml_file_path: pathlib.Path
+        Path to the TOML file
+
+    Returns
+    -------
+    dict
+        The parsed TOML
+    """
+    with open(toml_file_path, "r") as fh:
+        return loads(fh.read())
+
+
+def _check_chunks(settings, where):
+    """
+    Check min_chunks and max_chunks, returning a list of problems found
+    """
+    problems = []
+    for key in CHUNK_KEYS:
+        if key in settings and (type(settings[key]) is not int or settings[key] < 0):
+            problems.append(f"{where}.{key} must be a non-negative integer, not {settings[key]!r}")
+    if not problems and settings.get("min_chunks", 0) > settings.get("max_chunks", float("inf")):
+        problems.append(f"{where}.min_chunks cannot be more than {where}.max_chunks")
+    return problems
+
+
+def _check_behaviours(settings, where):
+    """
+    Check the unblock behaviour actions, returning a list of problems found
+    """
+    return [
+        f"{where}.{key} must be one of {sorted(BEHAVIOUR_ACTIONS)}, not {settings[key]!r}"
+        for key in BEHAVIOUR_KEYS
+        if key in settings and settings[key] not in BEHAVIOUR_ACTIONS
+    ]
+
+
+def validate_conditions_toml(dicty):
+    """
+    Check a readfish TOML has caller settings and well formed conditions, before we start running against it
+    Parameters
+    ----------
+    dicty: dict
+        The parsed readfish TOML
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        Listing every problem found with the TOML
+    """
+    problems = []
+    for table in ("caller_settings", "conditions"):
+        if not isinstance(dicty.get(table), dict):
+            problems.append(f"missing [{table}] table")
+    conditions = dicty.get("conditions") if isinstance(dicty.get("conditions"), dict) else {}
+    for name, condition in conditions.items():
+        if not isinstance(condition, dict):
+            continue
+        where = f"conditions.{name}"
+        missing = [key for key in CONDITION_KEYS if key not in condition]
+        if missing:
+            problems.append(f"{where} is missing {', '.join(missing)}")
+        if "control" in condition and type(condition["control"]) is not bool:
+            problems.append(f"{where}.control must be true or false, not {condition['control']!r}")
+        targets = condition.get("targets", [])
+        if not isinstance(targets, str) and not (
+            isinstance(targets, list) and all(isinstance(target, str) for target in targets)
+        ):
+            problems.append(f"{where}.targets must be a path or an array of strings")
+        problems.extend(_check_chunks(condition, where))
+        problems.extend(_check_behaviours(condition, where))
+    if problems:
+        raise ValueError("Invalid readfish TOML:\n" + "\n".join(problems))
+
+
+def validate_behaviours_toml(behaviours):
+    """
+    Check a behaviour TOML has the chunk_settings and unblock_behaviour tables that are merged into each barcode
+    Parameters
+    ----------
+    behaviours: dict
+        The parsed behaviour TOML
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        Listing every problem found with the TOML
+    """
+    problems = []
+    for table, allowed in (("chunk_settings", CHUNK_KEYS), ("unblock_behaviour", BEHAVIOUR_KEYS)):
+        settings = behaviours.get(table)
+        if not isinstance(settings, dict):
+            problems.append(f"missing [{table}] table")
+            continue
+        unknown = [key for key in settings if key not in allowed]
+        if unknown:
+            problems.append(f"unknown keys in [{table}]: {', '.join(unknown)}. Allowed keys are {', '.join(allowed)}")
+    if isinstance(behaviours.get("chunk_settings"), dict):
+        problems.extend(_check_chunks(behaviours["chunk_settings"], "chunk_settings"))
+    if isinstance(behaviours.get("unblock_behaviour"), dict):
+        problems.extend(_check_behaviours(behaviours["unblock_behaviour"], "unblock_behaviour"))
+    if problems:
+        raise ValueError("Invalid behaviour TOML:\n" + "\n".join(problems))
@@ -0,0 +1,219 @@
+"""
+Replay the archived minoTour snapshots of past runs through the target merging and behaviour pipeline, sweeping over
+behaviour parameters, to see what the TOML would have looked like.
+"""
+import copy
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from rich.logging import RichHandler
+
+from swordfish import readfish_toml
+from swordfish.accumulator import TargetAccumulator
+from swordfish.utils import get_original_toml_settings, merge_targets, _get_preset_behaviours
+
+formatter = logging.Formatter(
+        "[%(asctime)s] %(levelname)s - %(message)s", "%Y-%m-%d %H:%M:%S"
+    )
+handler = RichHandler()
+handler.setFormatter(formatter)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(handler)
+
+SUMMARY_FIELDS = (
+    "run", "behave_toml", "min_chunks", "max_chunks", "merge", "snapshots", "barcodes", "targets",
+    "max_barcode_targets", "toml_bytes",
+)
+
+
+def find_runs(archives):
+    """
+    Find the run directories holding timestamped snapshots, as written by write_out_timestamped_toml
+    Parameters
+    ----------
+    archives: list[pathlib.Path]
+        Run directories, or directories containing run directories
+
+    Returns
+    -------
+    list[pathlib.Path]
+        The run directories, sorted
+    """
+    runs = set()
+    for archive in archives:
+        if not archive.is_dir():
+            logger.error(f"Skipping {archive}, it {'is not a directory' if archive.exists() else 'does not exist'}")
+            continue
+        if any(archive.glob("*.json")):
+            runs.add(archive.resolve())
+        else:
+            runs.update(run.resolve() for run in archive.iterdir() if run.is_dir() and any(run.glob("*.json")))
+    return sorted(runs)
+
+
+def build_sweep(args):
+    """
+    Build every combination of the swept parameters
+    Parameters
+    ----------
+    args: argparse.Namespace
+        The argument parser options
+
+    Returns
+    -------
+    list[dict]
+        The parameter sets, each with its label fields and the behaviours to apply
+    """
+    sweep = []
+    for b_toml, min_chunks, max_chunks, merge in itertools.product(
+        args.b_tomls, args.min_chunks or [None], args.max_chunks or [None], args.merge
+    ):
+        try:
+            behaviours = copy.deepcopy(_get_preset_behaviours(b_toml))
+            if min_chunks is not None:
+                behaviours["chunk_settings"]["min_chunks"] = min_chunks
+            if max_chunks is not None:
+                behaviours["chunk_settings"]["max_chunks"] = max_chunks
+            readfish_toml.validate_behaviours_toml(behaviours)
+        except (ValueError, FileNotFoundError) as e:
+            logger.warning(f"Skipping {b_toml} min_chunks={min_chunks} max_chunks={max_chunks}: {e}")
+            continue
+        sweep.append({
+            "behave_toml": str(b_toml),
+            "min_chunks": behaviours["chunk_settings"].get("min_chunks"),
+            "max_chunks": behaviours["chunk_settings"].get("max_chunks"),
+            "merge": merge,
+            "behaviours": behaviours,
+        })
+    return sweep
+
+
+def reanalyse_run(run_dir, toml_file, sweep):
+    """
+    Replay each snapshot of one run, in the order they were fetched, for every parameter set in the sweep
+    Parameters
+    ----------
+    run_dir: pathlib.Path
+        The directory of timestamped snapshots for the run
+    toml_file: pathlib.Path
+        The readfish TOML the run was started with
+    sweep: list[dict]
+        The parameter sets, as returned by build_sweep
+
+    Returns
+    -------
+    list[dict]
+        One summary row per parameter set
+
+    Raises
+    ------
+    ValueError
+        If a snapshot is not valid JSON, or not a snapshot of barcode conditions
+    """
+    # Snapshots are named by the time they were fetched, so sort into the order they were fetched
+    snapshots = []
+    for snapshot_path in sorted(run_dir.glob("*.json")):
+        snapshot = snapshot_path.read_text()
+        try:
+            parsed = json.loads(snapshot)
+        except ValueError as e:
+            raise ValueError(f"{snapshot_path.name} is not valid JSON, it may have been cut short: {e}")
+        if not isinstance(parsed, dict):
+            raise ValueError(f"{snapshot_path.name} is not a snapshot of barcode conditions")
+        snapshots.append(snapshot)
+    base_settings_dict, base_barcodes = get_original_toml_settings(toml_file)
+    rows = []
+    for params in sweep:
+        og_settings_dict, existing_barcodes = copy.deepcopy((base_settings_dict, base_barcodes))
+        if params["merge"] == "replace":
+            existing_barcodes = {}
+        accumulator = TargetAccumulator(existing_barcodes) if params["merge"] == "accumulate" else None
+        data = {}
+        for snapshot in snapshots:
+            data = json.loads(snapshot)
+            data.pop("timestamp", None)
+            if accumulator is not None:
+                data = accumulator.update(data, params["behaviours"])
+            else:
+                # As update_extant_targets, each poll is merged with the barcodes in the original TOML
+                data = merge_targets(data, existing_barcodes, params["behaviours"])
+        og_settings_dict["conditions"].update(data)
+        fh = io.StringIO()
+        readfish_toml.dump(og_settings_dict, fh)
+        targets = [len(conditions.get("targets", [])) for conditions in data.values()]
+        row = {key: value for key, value in params.items() if key != "behaviours"}
+        row.update({
+            "run": run_dir.name,
+            "snapshots": len(snapshots),
+            "barcodes": len(data),
+            "targets": sum(targets),
+            "max_barcode_targets": max(targets, default=0),
+            "toml_bytes": len(fh.getvalue().encode()),
+        })
+        rows.append(row)
+    return rows
+
+
+def _reanalyse_job(job):
+    # The accumulator logs every poll, which would swamp the log across hundreds of runs
+    logging.getLogger("swordfish.accumulator").setLevel(logging.WARNING)
+    try:
+        return reanalyse_run(*job)
+    except (ValueError, OSError) as e:
+        # A run killed mid poll can leave a truncated snapshot behind, which shouldn't stop the rest of the sweep
+        logger.error(f"Skipping run {job[0]}: {e}")
+        return []
+
+
+def reanalyse(args, sf_version):
+    """
+    Reanalyse every archived run against every combination of the swept parameters, across a pool of processes
+    Parameters
+    ----------
+    args: argparse.Namespace
+        The argument parser options
+    sf_version: str
+        The version of swordfish package
+
+    Returns
+    -------
+    None
+    """
+    if not args.toml.is_file():
+        raise FileNotFoundError(args.toml)
+    try:
+        get_original_toml_settings(args.toml)
+    except ValueError as e:
+        logger.error(str(e))
+        return
+    runs = find_runs(args.archive)
+    if not runs:
+        logger.error(f"No runs with snapshots found in {', '.join(map(str, args.archive))}")
+        return
+    sweep = build_sweep(args)
+    if not sweep:
+        logger.error("No valid parameter sets to reanalyse with")
+        return
+    workers = args.workers or os.cpu_count()
+    logger.info(f"Reanalysing {len(runs)} runs with {len(sweep)} parameter sets across {workers} processes")
+    start = time.perf_counter()
+    jobs = [(run, args.toml, sweep) for run in runs]
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(args.out, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=SUMMARY_FIELDS, delimiter="\t")
+        writer.writeheader()
+        reanalysed = 0
+        for rows in executor.map(_reanalyse_job, jobs, chunksize=max(len(jobs) // (workers * 4), 1)):
+            writer.writerows(rows)
+            reanalysed += bool(rows)
+    logger.info(
+        f"Reanalysed {reanalysed} of {len(runs)} runs in {time.perf_counter() - start:.1f}s. "
+        f"Summary written to {args.out}"
+    )
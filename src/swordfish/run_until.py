@@ -0,0 +1,93 @@
+"""
+Run until - decide when every barcode has what it needs, so the position can be freed up
+"""
+
+
+class RunUntil:
+    """
+    Track per barcode completion across polls, and report when the run until criteria are met.
+
+    In balance mode a barcode is complete once the number of amplicons minoTour reports over the threshold reaches the
+    number of amplicons in the scheme. In breakpoints mode a barcode is complete once its targets have not changed for
+    stable_polls consecutive polls.
+    """
+
+    def __init__(self, mode, amplicons=None, stable_polls=5, barcode_fraction=1.0, expected_barcodes=None):
+        """
+        Parameters
+        ----------
+        mode: str
+            The subcommand being run, balance or breakpoints
+        amplicons: int
+            Number of amplicons in the scheme, required for balance mode
+        stable_polls: int
+            Number of polls a barcodes targets must be unchanged for to be converged, in breakpoints mode
+        barcode_fraction: float
+            Fraction of the barcodes that must be complete to meet the criteria
+        expected_barcodes: list[str]
+            Barcodes that count as incomplete until minoTour reports them, so a barcode that has not been seen yet
+            cannot be left behind. Default - only the barcodes minoTour has reported
+        """
+        # Either of these being less than 1 would count every barcode as complete on the first poll
+        if mode == "balance" and (amplicons is None or amplicons < 1):
+            raise ValueError(
+                "The number of amplicons in the scheme is required for run until in balance mode, "
+                "set it to at least 1 with --amplicons"
+            )
+        if mode == "breakpoints" and (stable_polls is None or stable_polls < 1):
+            raise ValueError("--stable-polls must be at least 1")
+        self.mode = mode
+        self.amplicons = amplicons
+        self.stable_polls = stable_polls
+        self.barcode_fraction = barcode_fraction
+        self.complete = {barcode: False for barcode in expected_barcodes or []}
+        self._last_targets = {}
+        self._unchanged = {}
+
+    def _barcode_complete(self, barcode, targets):
+        if self.mode == "balance":
+            return len(targets) >= self.amplicons
+        targets = frozenset(targets)
+        if self._last_targets.get(barcode) == targets:
+            self._unchanged[barcode] += 1
+        else:
+            self._unchanged[barcode] = 0
+            self._last_targets[barcode] = targets
+        return self._unchanged[barcode] >= self.stable_polls
+
+    def update(self, data):
+        """
+        Update the barcode completion with the conditions fetched from minoTour this poll
+        Parameters
+        ----------
+        data: dict
+            Barcode names keyed to their readfish conditions
+
+        Returns
+        -------
+        bool
+            True if the run until criteria have been met
+        """
+        for barcode, conditions in data.items():
+            if isinstance(conditions, dict):
+                self.complete[barcode] = self._barcode_complete(barcode, conditions.get("targets", []))
+        return bool(self.complete) and self.n_complete >= self.barcode_fraction * len(self.complete)
+
+    @property
+    def n_complete(self):
+        """
+        Returns
+        -------
+        int
+            The number of complete barcodes
+        """
+        return sum(self.complete.values())
+
+    def incomplete_barcodes(self):
+        """
+        Returns
+        -------
+        list[str]
+            The barcodes that are not yet complete
+        """
+        return sorted(barcode for barcode, complete in self.complete.items() if not complete)
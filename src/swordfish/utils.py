@@ -8,7 +8,6 @@ from pathlib import Path
 from pprint import pformat
 from webbrowser import get
 
-import toml
 from grpc import RpcError
 import minknow_api
 from minknow_api.manager import Manager
@@ -17,6 +16,7 @@ import sys
 
 from rich.logging import RichHandler
 from swordfish.endpoints import EndPoint
+from swordfish import readfish_toml
 
 formatter = logging.Formatter(
         "[%(asctime)s] %(levelname)s - %(message)s", "%Y-%m-%d %H:%M:%S"
@@ -99,7 +99,7 @@ def write_toml_file(data, toml_file_path):
     if not str(toml_file_path).endswith("_live"):
         toml_file_path = f"{toml_file_path}_live"
     with open(toml_file_path, "w") as fh:
-        toml.dump(data, fh)
+        readfish_toml.dump(data, fh)
     logger.info(f"Successfully updated toml file at {toml_file_path}")
 
 
@@ -114,9 +114,14 @@ def get_original_toml_settings(toml_file_path):
     -------
     dict
         Dict of the settings we will keep between iterations
+
+    Raises
+    ------
+    ValueError
+        If the toml file is not a valid readfish TOML
     """
-    with open(toml_file_path, "r") as fh:
-        dicty = toml.load(fh)
+    dicty = readfish_toml.load(toml_file_path)
+    readfish_toml.validate_conditions_toml(dicty)
     keys = {"classified", "unclassified"}
     toml_dict = {"caller_settings": dicty["caller_settings"]}
     # nested dictionary conditions faff
@@ -168,7 +173,31 @@ def get_run_id(args):
     return run_id
 
 
-def update_extant_targets(new_data: dict, toml_file_path: Path, behaviours: dict) -> dict:
+def stop_protocol(args):
+    """
+    Stop the protocol running on the MinKNOW position, ending the acquisition
+    Parameters
+    ----------
+    args: argparse.Namespace
+        The argument parser options
+
+    Returns
+    -------
+    bool
+        True if the protocol was stopped
+    """
+    try:
+        position = get_device(args.device, host=args.mk_host, port=args.mk_port)
+        mk_api = position.connect()
+        mk_api.protocol.stop_protocol()
+    except (RuntimeError, RpcError) as e:
+        logger.error(f"Could not stop the protocol on {args.device}: {repr(e)}")
+        return False
+    logger.info(f"Stopped the protocol on {args.device}.")
+    return True
+
+
+def update_extant_targets(new_data: dict, toml_file_path: Path, behaviours: dict, merger=None) -> dict:
     """
     Update any barcode we already have in the target TOML file by adding targets in place,
      so we accrue targets rather than overwrite them.
@@ -180,23 +209,66 @@ def update_extant_targets(new_data: dict, toml_file_path: Path, behaviours: dict
         Path to the toml file that will be read
     behaviours: dict
         dict containing behaviours as provided
+    merger: swordfish.parallel_merge.ParallelMerger
+        Merge the barcodes across a pool of processes, if provided
     Returns
     -------
     dict
         Data to be written to the toml file
     """
     _, existing_barcodes = get_original_toml_settings(toml_file_path)
+    if merger is not None:
+        return merger.merge(new_data, existing_barcodes, behaviours)
+    return merge_targets(new_data, existing_barcodes, behaviours)
+
+
+def merge_targets(new_data: dict, existing_barcodes: dict, behaviours: dict) -> dict:
+    """
+    Add the targets of any barcodes we already have to the newly fetched targets, and apply the behaviours to each barcode
+    Parameters
+    ----------
+    new_data: dict
+        Data that has been fetched from minoTour this iteration
+    existing_barcodes: dict
+        Barcode names keyed to the conditions we already have for them
+    behaviours: dict
+        dict containing behaviours as provided
+    Returns
+    -------
+    dict
+        Data to be written to the toml file
+    """
     for barcode, conditions in new_data.items():
-        if barcode in existing_barcodes:
-            targets = set(existing_barcodes[barcode].get("targets", []))
-            new_targets = set(conditions.get("targets", []))
-            targets.update(new_targets)
-            new_data[barcode]["targets"] = sorted(list(targets))
-        new_data[barcode].update(behaviours["chunk_settings"])
-        new_data[barcode].update(behaviours["unblock_behaviour"])
+        new_data[barcode] = merge_barcode(conditions, existing_barcodes.get(barcode), behaviours)
     return new_data
 
 
+def merge_barcode(conditions: dict, existing_conditions: dict, behaviours: dict) -> dict:
+    """
+    Merge the targets of one barcode in place, and apply the behaviours to it
+    Parameters
+    ----------
+    conditions: dict
+        The conditions fetched from minoTour this iteration for the barcode
+    existing_conditions: dict
+        The conditions we already have for the barcode, or None if we have none
+    behaviours: dict
+        dict containing behaviours as provided
+    Returns
+    -------
+    dict
+        The updated conditions
+    """
+    if existing_conditions is not None:
+        targets = set(existing_conditions.get("targets", []))
+        new_targets = set(conditions.get("targets", []))
+        targets.update(new_targets)
+        conditions["targets"] = sorted(list(targets))
+    conditions.update(behaviours["chunk_settings"])
+    conditions.update(behaviours["unblock_behaviour"])
+    return conditions
+
+
 def _check_behaviour_toml(behaviour_toml: Path) -> Path:
     """
     Check the behaviour toml provided exists.
@@ -226,9 +298,15 @@ def _get_preset_behaviours(behaviour_toml: Path) -> dict:
     -------
     dict
         The behaviour unblocks
+
+    Raises
+    ------
+    ValueError
+        If the chunk_settings or unblock_behaviour tables are missing or invalid
     """
     toml_path = _check_behaviour_toml(behaviour_toml)
-    behaviours = toml.load(toml_path)
+    behaviours = readfish_toml.load(toml_path)
+    readfish_toml.validate_behaviours_toml(behaviours)
     logger.info(pformat(behaviours))
     return behaviours
 
@@ -0,0 +1,87 @@
+"""
+The readfish TOML reader and writer must stay byte for byte compatible with the toml package
+"""
+import io
+from pathlib import Path
+
+import pytest
+import toml
+
+from swordfish import readfish_toml
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+
+def _dumps(data):
+    fh = io.StringIO()
+    readfish_toml.dump(data, fh)
+    return fh.getvalue()
+
+
+@pytest.mark.parametrize("toml_file", ["example.toml", "chunkalicious.toml"])
+def test_repo_tomls_round_trip(toml_file):
+    text = (REPO_ROOT / toml_file).read_text()
+    data = readfish_toml.loads(text)
+    assert data == toml.loads(text)
+    assert _dumps(data) == toml.dumps(data)
+    assert readfish_toml.loads(_dumps(data)) == data
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "plain",
+        "",
+        'quote " and backslash \\',
+        "tab\tnewline\ncarriage return\r",
+        "control \x01 \x1f \x7f",
+        "non ASCII é ü 日本 🐟",
+        "ends with a newline\n",
+    ],
+)
+def test_strings_round_trip(value):
+    data = {
+        value: value,
+        "targets": [value, "chr1,100,200,+", value],
+        "conditions": {"barcode01": {"name": value, "targets": [value]}},
+    }
+    assert _dumps(data) == toml.dumps(data)
+    assert readfish_toml.loads(_dumps(data)) == toml.loads(toml.dumps(data))
+
+
+def test_values_round_trip():
+    data = {
+        "caller_settings": {"port": 5555, "barcode_kits": ["EXP-NBD196"], "ratio": 0.5},
+        "conditions": {
+            "reference": "/path/to/reference.mmi",
+            "barcode01": {"control": False, "min_chunks": 0, "max_chunks": 4, "targets": [], "skip": None},
+            "nested": {"deeper": {"deepest": {"flag": True}}},
+        },
+        "numbers": [1, -2, 3],
+        "mixed": [[1, 2], ["a", "b"]],
+    }
+    assert _dumps(data) == toml.dumps(data)
+    assert readfish_toml.loads(_dumps(data)) == toml.loads(toml.dumps(data))
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        'inline = { name = "barcode01", min_chunks = 0 }\n',
+        'multi_line = """\nchr1,100,200,+\n"""\n',
+        'dotted.key = "value"\n',
+        'when = 2022-01-01T00:00:00Z\n',
+        '"quoted key" = 1\n',
+        "[[array_of_tables]]\nname = 'a'\n",
+        "hex = 0xFF\n",
+    ],
+)
+def test_fallback_matches_toml(text):
+    with pytest.raises(readfish_toml._Unsupported):
+        readfish_toml._fast_loads(text)
+    assert readfish_toml.loads(text) == toml.loads(text)
+
+
+@pytest.mark.parametrize("value", ["chr1,100,200,+", 'a"b', "é", 3, True, [1, "a"]])
+def test_dump_value(value):
+    assert readfish_toml.dump_value(value) == str(toml.TomlEncoder().dump_value(value))